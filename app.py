@@ -2,40 +2,154 @@
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+import shapely
+import h3
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 from dash import Dash, dcc, html, Input, Output
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+from flask_caching import Cache
 import os
+from functools import lru_cache
 
 # --- Initialize app ---
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.title = "Calabria Wildfire Dashboard"
 server = app.server  # Required for Render
+pio.json.config.default_engine = "orjson"  # also used by Dash when encoding callback responses
+cache = Cache(server, config={"CACHE_TYPE": "FileSystemCache", "CACHE_DIR": "./cache"})
 
 # --- Load and prepare data ---
 print("📂 Working directory:", os.getcwd())
 print("📁 Files in /data:", os.listdir("data"))
 
-gdf = gpd.read_file("data/calabria_fires_3035.shp")
-gdf = gdf.to_crs(epsg=3857)  # Web Mercator for area calculation
-gdf["geometry"] = gdf.geometry.apply(lambda g: g if g.is_valid else g.buffer(0))
-gdf["area_ha"] = gdf.geometry.area / 10_000  # m² to hectares
+SHAPEFILE_PATH = "data/calabria_fires_3035.shp"
+PREP_VERSION = 1  # bump whenever the preprocessing below changes, so stale files are ignored
+PREPARED_PATH = f"data/calabria_prepared_v{PREP_VERSION}.parquet"  # GeoParquet cache of the cleaned data
+MONTH_NAMES = np.array(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])
+H3_RESOLUTION = 7  # hex size (~5 km²) used to bin small fires on the map
+MAP_BIN_THRESHOLD = 10_000  # above this many fires, small ones are binned into hexes
 
-# 🔍 Clean and format
-gdf["date"] = pd.to_datetime(gdf["FIREDATE"], errors="coerce")
-gdf.dropna(subset=["date", "area_ha"], inplace=True)
-gdf["year"] = gdf["date"].dt.year
-gdf["month"] = gdf["date"].dt.month
-gdf["year_month"] = gdf["date"].dt.to_period("M").astype(str)
-gdf["season"] = gdf["month"].apply(lambda m: "Summer" if 5 <= m <= 10 else "Winter")
-gdf["size"] = gdf["area_ha"].apply(lambda a: "Big" if a > 100 else "Small")
+# The shapefile is several files (FIREDATE lives in the .dbf), so any part changing invalidates the cache
+shapefile_parts = [os.path.splitext(SHAPEFILE_PATH)[0] + ext for ext in [".shp", ".dbf", ".shx", ".prj", ".cpg"]]
+source_mtime = max(os.path.getmtime(part) for part in shapefile_parts if os.path.exists(part))
+
+if os.path.exists(PREPARED_PATH) and os.path.getmtime(PREPARED_PATH) >= source_mtime:
+    gdf = gpd.read_parquet(PREPARED_PATH)
+else:
+    gdf = gpd.read_file(
+        SHAPEFILE_PATH,
+        engine="pyogrio", use_arrow=True,  # Arrow-backed reads (needs GDAL >= 3.6)
+        columns=["FIREDATE"]  # only the date and geometry are used downstream
+    )
+    gdf = gdf.to_crs(epsg=3857)  # Web Mercator for area calculation
+    gdf["geometry"] = shapely.make_valid(gdf.geometry.values)  # vectorized GEOS MakeValid
+    gdf["area_ha"] = (gdf.geometry.area / 10_000).astype("float32")  # m² to hectares
+
+    # 🔍 Clean and format
+    gdf["date"] = pd.to_datetime(gdf["FIREDATE"], errors="coerce")
+    gdf.dropna(subset=["date", "area_ha"], inplace=True)
+    gdf["year"] = gdf["date"].dt.year
+    gdf["month"] = gdf["date"].dt.month
+    gdf["season"] = pd.Categorical(
+        np.where(gdf["month"].between(5, 10), "Summer", "Winter"), categories=["Summer", "Winter"]
+    )
+    gdf["size"] = pd.Categorical(
+        np.where(gdf["area_ha"].values > 100, "Big", "Small"), categories=["Big", "Small"]
+    )
+
+    # 🏷️ Categorical keys so groupbys hash precomputed codes
+    gdf["year"] = pd.Categorical(
+        gdf["year"], categories=range(gdf["year"].min(), gdf["year"].max() + 1), ordered=True
+    )
+    gdf["month"] = pd.Categorical(gdf["month"], categories=range(1, 13), ordered=True)
+
+    # 🗺️ Fire centroids in WGS84 for the map
+    centroids = gdf.geometry.centroid.to_crs(epsg=4326)
+    gdf["lat"] = centroids.y.values.astype("float32")
+    gdf["lon"] = centroids.x.values.astype("float32")
+    gdf["hex"] = pd.Categorical([
+        h3.latlng_to_cell(lat, lon, H3_RESOLUTION) for lat, lon in zip(gdf["lat"], gdf["lon"])
+    ])
+
+    gdf = gdf.drop(columns=["FIREDATE", "date"])  # only needed to derive year/month
+    # Write then rename so concurrent workers never read a half-written file
+    tmp_path = f"{PREPARED_PATH}.{os.getpid()}.tmp"
+    gdf.to_parquet(tmp_path)  # geometry stored as WKB per the GeoParquet spec
+    os.replace(tmp_path, PREPARED_PATH)
+
+# Cached figures may come from older code or data, so never reuse them across restarts
+cache.clear()
+
+# 📊 Aggregates precomputed once; callbacks only slice them by year
+YEAR_MIN, YEAR_MAX = int(gdf["year"].min()), int(gdf["year"].max())
+N_YEARS = YEAR_MAX - YEAR_MIN + 1
+
+# Dense (year x month) burned-area and fire-count matrices, one bincount pass each
+ym_index = (gdf["year"].astype(int).to_numpy() - YEAR_MIN) * 12 + gdf["month"].astype(int).to_numpy() - 1
+AREA_YM = np.bincount(ym_index, weights=gdf["area_ha"].to_numpy(np.float64), minlength=N_YEARS * 12).reshape(N_YEARS, 12)
+COUNT_YM = np.bincount(ym_index, minlength=N_YEARS * 12).reshape(N_YEARS, 12)
+
+AGG_YM = pd.DataFrame({
+    "year": np.repeat(np.arange(YEAR_MIN, YEAR_MAX + 1), 12),
+    "month": np.tile(np.arange(1, 13), N_YEARS),
+    "area": AREA_YM.ravel(),
+    "count": COUNT_YM.ravel()
+})
+AGG_YM = AGG_YM[AGG_YM["count"] > 0].reset_index(drop=True)
+AGG_Y = pd.DataFrame(
+    {"area": AREA_YM.sum(axis=1), "count": COUNT_YM.sum(axis=1)},
+    index=pd.RangeIndex(YEAR_MIN, YEAR_MAX + 1, name="year")
+)
+AGG_Y = AGG_Y[AGG_Y["count"] > 0]
+
+# 🗺️ Map columns sorted by year so a year range is a contiguous slice (no mask, no geometry)
+FIRES_BY_YEAR = pd.DataFrame(gdf[["lat", "lon", "area_ha", "season", "size", "hex"]]).set_index(
+    gdf["year"].astype(int)
+).sort_index()
+
+
+def to_json(fig):
+    """Serialize a figure once so cache hits skip Plotly's encoder entirely."""
+    return pio.to_json(fig, validate=False)
+
+
+# 📈 Time series for every year, built once; the browser hides years outside the slider range
+def build_timeseries():
+    ts = AGG_YM.copy()
+    ts["month_name"] = pd.Categorical.from_codes(ts["month"].values - 1, categories=MONTH_NAMES, ordered=True)
+    ts = ts.sort_values(["year", "month"])
+
+    fig1 = px.line(ts, x="month_name", y="area", color="year", markers=True,
+                   title="🔥 Burned Area by Month (EFFIS2000_2025)")
+    fig1.update_yaxes(range=[0, 50000])
+    fig1.update_layout(
+        xaxis=dict(categoryorder='array', categoryarray=MONTH_NAMES),
+        shapes=[
+            dict(type="rect", xref="x", yref="paper", x0="Jan", x1="May", y0=0, y1=1,
+                 fillcolor="LightBlue", opacity=0.3, layer="below"),
+            dict(type="rect", xref="x", yref="paper", x0="May", x1="Oct", y0=0, y1=1,
+                 fillcolor="LightPink", opacity=0.3, layer="below"),
+            dict(type="rect", xref="x", yref="paper", x0="Oct", x1="Dec", y0=0, y1=1,
+                 fillcolor="LightBlue", opacity=0.3, layer="below")
+        ]
+    )
+    for trace in fig1.data:
+        trace.meta = int(trace.name)  # year tag used by the client-side filter
+    fig1.add_trace(go.Scatter(x=[None], y=[None], mode="markers", marker=dict(size=10, color="LightPink"), name="Summer (May–Oct)"))
+    fig1.add_trace(go.Scatter(x=[None], y=[None], mode="markers", marker=dict(size=10, color="LightBlue"), name="Winter (Nov–Apr)"))
+    return to_json(fig1)
+
+
+TIMESERIES_JSON = build_timeseries()
 
 # --- App Layout ---
 app.layout = dbc.Container([
     html.H2("🔥 Calabria Wildfire Explorer", className="text-center mt-4 mb-3"),
-    dcc.Tabs([
-        dcc.Tab(label="📊 Dashboard", children=[
+    dcc.Tabs(id="tabs", value="dashboard", children=[
+        dcc.Tab(label="📊 Dashboard", value="dashboard", children=[
             dbc.Row([
                 dbc.Col([
                     html.Label("Year Range:"),
@@ -43,8 +157,10 @@ app.layout = dbc.Container([
                         min=gdf["year"].min(), max=gdf["year"].max(), step=1,
                         value=[gdf["year"].min(), gdf["year"].max()],
                         marks={int(y): str(y) for y in sorted(gdf["year"].unique())},
+                        updatemode="mouseup",
                         id="year-slider"
-                    )
+                    ),
+                    dcc.Store(id="year-range", data=[YEAR_MIN, YEAR_MAX])  # debounced slider value
                 ], md=12)
             ], className="mb-4"),
 
@@ -53,87 +169,81 @@ app.layout = dbc.Container([
                 dbc.Col(dcc.Graph(id="map-chart"), md=6)
             ]),
 
-            html.Div(id="summary-box", className="mt-3")
+            html.Div(id="summary-box", className="mt-3"),
+            dcc.Store(id="full-data", storage_type="memory", data=TIMESERIES_JSON),
+            dcc.Store(id="map-json")
         ]),
-        dcc.Tab(label="🔘 Circle Matrix Grid", children=[
+        dcc.Tab(label="🔘 Circle Matrix Grid", value="circle-matrix", children=[
             dcc.Graph(id="circle-matrix", figure=go.Figure(
                 layout=dict(title="🧪 Placeholder – Circle Matrix Grid")
-            ))
+            )),
+            dcc.Store(id="circle-matrix-json")
         ])
     ])
 ], fluid=True)
 
-# --- Callbacks ---
-@app.callback(
-    Output("timeseries-chart", "figure"),
-    Output("map-chart", "figure"),
-    Output("summary-box", "children"),
-    Input("year-slider", "value")
-)
-def update_dashboard(year_range):
-    df = gdf[(gdf["year"] >= year_range[0]) & (gdf["year"] <= year_range[1])].copy()
-
-    # 📈 Time Series
-    ts = df.groupby(["year", "month"]).agg(area=("area_ha", "sum")).reset_index()
-    ts["month_name"] = pd.to_datetime(ts["month"], format="%m").dt.strftime("%b")
-    month_order = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-    ts["month_name"] = pd.Categorical(ts["month_name"], categories=month_order, ordered=True)
-    ts = ts.sort_values(["year", "month"])
-
-    fig1 = px.line(ts, x="month_name", y="area", color="year", markers=True,
-                   title="🔥 Burned Area by Month (EFFIS2000_2025)")
-    fig1.update_yaxes(range=[0, 50000])
-    fig1.update_layout(
-        xaxis=dict(categoryorder='array', categoryarray=month_order),
-        shapes=[
-            dict(type="rect", xref="x", yref="paper", x0="Jan", x1="May", y0=0, y1=1,
-                 fillcolor="LightBlue", opacity=0.3, layer="below"),
-            dict(type="rect", xref="x", yref="paper", x0="May", x1="Oct", y0=0, y1=1,
-                 fillcolor="LightPink", opacity=0.3, layer="below"),
-            dict(type="rect", xref="x", yref="paper", x0="Oct", x1="Dec", y0=0, y1=1,
-                 fillcolor="LightBlue", opacity=0.3, layer="below")
-        ]
-    )
-    fig1.add_trace(go.Scatter(x=[None], y=[None], mode="markers", marker=dict(size=10, color="LightPink"), name="Summer (May–Oct)"))
-    fig1.add_trace(go.Scatter(x=[None], y=[None], mode="markers", marker=dict(size=10, color="LightBlue"), name="Winter (Nov–Apr)"))
+# --- Figure builders ---
+# Keyed on (y0, y1) and pure since gdf never changes after startup. The in-process LRU answers
+# repeated slider values and never expires; the filesystem cache underneath (cleared at startup)
+# is only consulted on a process's first request for a range, so workers can reuse each other's work
+@lru_cache(maxsize=256)
+@cache.memoize()
+def build_map(y0, y1):
+    df = FIRES_BY_YEAR.loc[y0:y1]
 
-    # 🗺️ Map
-    gdf_wgs = df.to_crs(epsg=4326)
+    points = df[["lat", "lon", "area_ha", "season"]].reset_index().assign(fires=1)
+    if len(df) > MAP_BIN_THRESHOLD:
+        # Small fires are binned into one marker per hex, coloured by their majority season;
+        # big fires stay individual so outliers remain visible
+        is_big = (df["size"] == "Big").values
+        small = df[~is_big].assign(summer=df["season"] == "Summer").groupby(
+            "hex", observed=True, sort=False
+        ).agg(
+            lat=("lat", "mean"), lon=("lon", "mean"), area_ha=("area_ha", "sum"),
+            fires=("area_ha", "count"), summer=("summer", "mean")
+        ).reset_index(drop=True)
+        small["season"] = pd.Categorical(
+            np.where(small.pop("summer") >= 0.5, "Summer", "Winter"), categories=["Summer", "Winter"]
+        )
+        points = pd.concat([points[is_big], small], ignore_index=True)
+        points["year"] = points["year"].astype("Int64")  # hexes mix years, so theirs stays empty
     fig2 = px.scatter_mapbox(
-        gdf_wgs,
-        lat=gdf_wgs.geometry.centroid.y,
-        lon=gdf_wgs.geometry.centroid.x,
+        points, lat="lat", lon="lon",  # centroids precomputed at startup
         size="area_ha", color="season", zoom=7,
-        hover_data=["year", "area_ha"], mapbox_style="carto-positron",
+        hover_data=["year", "fires", "area_ha"], mapbox_style="carto-positron",
         title="🗺️ Fire Locations"
     )
+    return to_json(fig2)
+
 
-    # 📦 Summary
-    total_fires = len(df)
-    total_area = df["area_ha"].sum()
-    peak_year_by_fires = df["year"].value_counts().idxmax()
-    peak_fires_count = df["year"].value_counts().max()
-    peak_year_by_area = df.groupby("year")["area_ha"].sum().idxmax()
-    peak_area_value = df.groupby("year")["area_ha"].sum().max()
+@lru_cache(maxsize=256)
+def build_summary(y0, y1):
+    yearly = AGG_Y.loc[y0:y1]
+    total_fires, total_area = yearly["count"].sum(), yearly["area"].sum()
+    peak_year_by_fires = yearly["count"].idxmax()
+    peak_fires_count = yearly.at[peak_year_by_fires, "count"]
+    peak_year_by_area = yearly["area"].idxmax()
+    peak_area_value = yearly.at[peak_year_by_area, "area"]
 
     summary = f"""
     🔥 Total Fires: {total_fires:,} 🌍 Burned Area: {total_area:,.0f} ha  
     🗓️ Peak Year by # of Fires: {peak_year_by_fires} ({peak_fires_count} fires)  
     🗓️ Peak Year by Burned Area: {peak_year_by_area} ({peak_area_value:,.0f} ha)
     """
+    return summary
 
-    return fig1, fig2, html.Pre(summary)
 
-# --- Run app locally ---
-
-@app.callback(Output("circle-matrix", "figure"), Input("year-slider", "value"))
-def circle_matrix(year_range):
-    df = gdf[(gdf["year"] >= year_range[0]) & (gdf["year"] <= year_range[1])]
-    all_months = pd.DataFrame({"month": list(range(1, 13)), "key": 1})
-    all_years = pd.DataFrame({"year": list(range(year_range[0], year_range[1] + 1)), "key": 1})
-    full_grid = pd.merge(all_years, all_months, on="key").drop("key", axis=1)
-    grouped = df.groupby(["year", "month"]).agg(count=("area_ha", "count"), area=("area_ha", "sum")).reset_index()
-    grid = pd.merge(full_grid, grouped, on=["year", "month"], how="left").fillna(0)
+@lru_cache(maxsize=256)
+@cache.memoize()
+def build_circle_matrix(y0, y1):
+    rows = slice(y0 - YEAR_MIN, y1 - YEAR_MIN + 1)
+    n_years = y1 - y0 + 1
+    grid = pd.DataFrame({
+        "year": np.repeat(np.arange(y0, y1 + 1), 12),
+        "month": np.tile(np.arange(1, 13), n_years),
+        "area": AREA_YM[rows].ravel(),
+        "count": COUNT_YM[rows].ravel()
+    })
     max_area = grid["area"].max()
     max_count = grid["count"].max()
     grid["radius"] = np.sqrt(grid["area"] / max_area) * 40 if max_area else 1
@@ -148,11 +258,85 @@ def circle_matrix(year_range):
     )
     fig.update_layout(
         yaxis=dict(autorange="reversed"),
-        xaxis=dict(tickmode="array", tickvals=list(range(1, 13)), ticktext=[
-            "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"
-        ])
+        xaxis=dict(tickmode="array", tickvals=list(range(1, 13)), ticktext=MONTH_NAMES)
+    )
+    return to_json(fig)
+
+
+# --- Callbacks ---
+# Server work only runs for the visible tab; switching tabs re-fires with the current range
+@app.callback(Output("map-json", "data"), Input("year-range", "data"), Input("tabs", "value"))
+def update_map(year_range, tab):
+    if tab != "dashboard":
+        raise PreventUpdate
+    return build_map(*year_range)
+
+
+@app.callback(Output("summary-box", "children"), Input("year-range", "data"), Input("tabs", "value"))
+def update_summary(year_range, tab):
+    if tab != "dashboard":
+        raise PreventUpdate
+    return html.Pre(build_summary(*year_range))
+
+# --- Run app locally ---
+
+@app.callback(Output("circle-matrix-json", "data"), Input("year-range", "data"), Input("tabs", "value"))
+def circle_matrix(year_range, tab):
+    if tab != "circle-matrix":
+        raise PreventUpdate
+    return build_circle_matrix(*year_range)
+
+# 🧩 Figures travel as pre-serialized JSON; the browser parses them straight into the graphs
+for graph_id in ["map-chart", "circle-matrix"]:
+    app.clientside_callback(
+        """
+        function(figure_json) {
+            return figure_json ? JSON.parse(figure_json) : window.dash_clientside.no_update;
+        }
+        """,
+        Output(graph_id, "figure"),
+        Input(f"{graph_id}-json", "data")
     )
-    return fig
+
+# ⏱️ Forward the slider value to the server callbacks only after 200 ms without a new value
+app.clientside_callback(
+    """
+    function(value) {
+        const dc = window.dash_clientside;
+        const ns = dc.calabria = dc.calabria || {};
+        clearTimeout(ns.yearTimer);
+        if (ns.yearResolve) {
+            ns.yearResolve(dc.no_update);  // superseded by this value
+        }
+        return new Promise(resolve => {
+            ns.yearResolve = resolve;
+            ns.yearTimer = setTimeout(() => {
+                ns.yearResolve = null;
+                resolve(value);
+            }, 200);
+        });
+    }
+    """,
+    Output("year-range", "data"),
+    Input("year-slider", "value"),
+    prevent_initial_call=True  # the store already starts at the slider's initial value
+)
+
+# 📈 Year filtering of the time series happens entirely in the browser
+app.clientside_callback(
+    """
+    function(year_range, full_json) {
+        const fig = JSON.parse(full_json);
+        fig.data = fig.data.filter(
+            t => t.meta === undefined || (t.meta >= year_range[0] && t.meta <= year_range[1])
+        );
+        return fig;
+    }
+    """,
+    Output("timeseries-chart", "figure"),
+    Input("year-slider", "value"),
+    Input("full-data", "data")
+)
 
 if __name__ == "__main__":
     app.run_server(debug=True)